@@ -7,49 +7,136 @@ be used by tai.py.
 '''
 
 
+import functools
+import numpy as np
+import os
+import string
+import types
 import utils as ut
 import warnings
 
 
-# Load settings
-settings = ut.read_json_file("tAI_settings.json")
+# All the lookup tables defined in this module are shared by every TAI object,
+# hence they are made immutable (read-only mappings, tuples and arrays).
+def _read_only(arr):
+    ''' Makes the input NumPy array read-only and returns it. '''
+    arr.setflags(write=False)
+    return arr
 
 
-bases = "tcag"
-codons = [x+y+z for x in bases for y in bases for z in bases]
-complement = {'t':'a', 'u':'a', 'a':'t', 'c':'g', 'g':'c'}
+# Directory of this module, used to resolve the settings and data paths
+_SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
 
+bases = "tcag"
+codons = tuple(x+y+z for x in bases for y in bases for z in bases)
+CODON_TO_IDX = types.MappingProxyType(
+    {codon: i for i, codon in enumerate(codons)})
+
+# Byte -> base index (position in `bases`, 'u' counting as 't'). 255 marks
+# characters that are not bases
+BASE_CODE = np.full(256, 255, dtype=np.uint8)
+for i, b in enumerate(bases):
+    BASE_CODE[ord(b)] = BASE_CODE[ord(b.upper())] = i
+BASE_CODE[ord('u')] = BASE_CODE[ord('U')] = bases.index('t')
+_read_only(BASE_CODE)
+
+# Methionine and STOP codons (ignored when computing tAI)
+METSTOP = frozenset({'atg', 'taa', 'tga', 'tag'})
+# METSTOP_MASK[i] is True if codons[i] is a Methionine or STOP codon
+METSTOP_MASK = _read_only(np.array([c in METSTOP for c in codons],
+                                   dtype=np.bool_))
+complement = types.MappingProxyType(
+    {'t':'a', 'u':'a', 'a':'t', 'c':'g', 'g':'c'})
+
+# Translation table used by normalize: lowercases all the ASCII letters and
+# writes Uracil as 't'
+_NORM_TABLE = str.maketrans(string.ascii_uppercase + "u",
+                            string.ascii_lowercase.replace("u", "t") + "t")
+
+# Translation tables used by rev_compl (the output is always lowercase)
+_COMP_TABLE = str.maketrans("acgtuACGTU", "tgcaatgcaa")
+_COMP_TABLE_U = str.maketrans("acgtuACGTU", "ugcaaugcaa")
+_COMP_CHARS = frozenset("acgtuACGTU")
+
+
+def normalize(sequence):
+    ''' Returns the input sequence with its ASCII letters in lowercase and
+    Uracil written as 't'. '''
+    return sequence.translate(_NORM_TABLE)
 
 def rev_compl(sequence, use_uracil=False):
     ''' Returns the reverse complement of the input sequence. '''
-    rev_compl_string = ""
-    for x in sequence[::-1].lower():
-        rev_compl_string += complement[x]
-    if use_uracil:
-        return rev_compl_string.replace("t", "u")
-    else:
-        return rev_compl_string
+    if not _COMP_CHARS.issuperset(sequence):
+        raise ValueError("The input sequence contains characters that are " +
+                         "not bases.")
+    table = _COMP_TABLE_U if use_uracil else _COMP_TABLE
+    return sequence.translate(table)[::-1]
+
+# Codon -> anticodons that pair perfectly with its first two bases
+ANTICODONS = types.MappingProxyType(
+    {codon: tuple(b + rev_compl(codon[:2]) for b in bases) for codon in codons})
+ANTICODON_SET = types.MappingProxyType(
+    {codon: frozenset(acs) for codon, acs in ANTICODONS.items()})
+
 
 def anticodons(codon):
-    ''' Returns the list of anticodons that pair perfectly with the first two
+    ''' Returns the tuple of anticodons that pair perfectly with the first two
     bases of the input codon. '''
-    return [b + rev_compl(codon[:2]) for b in bases]
+    return ANTICODONS[codon]
+
+def get_recognizer(codon, anticodon):
+    ''' Returns the base of the anticodon that pairs with the 3rd base of the
+    codon (the first base of the anticodon, accounting for modifications). '''
+    recognizer = anticodon[0]
+    
+    # Modification of Adenine to Inosine is assumed to be the standard in
+    # Bacteria for anticodons that have an Adenine in 1st position (which
+    # pairs with the 3rd position of the codon).
+    if recognizer == 'a':
+        recognizer = 'i'
+    
+    # The ATA codon for Isoleucine can be recognized by a modified CAT
+    # anticodon, where Cytosine is modified to Lysidine (L). The L in the
+    # LAT anticodon will pair with the third base (Adenine) of the ATA
+    # codon.
+    if (codon, anticodon) == ('ata', 'cat'):
+        recognizer = 'l'
+    
+    return recognizer
+
+def check_sequence_length(seq):
+    ''' Warns if the length of the input sequence is not a multiple of 3. '''
+    if int(len(seq)) % 3 != 0:
+        warnings.warn("The input sequence is " + str(int(len(seq))) +
+                      " bp long, which is not a multiple of 3.")
+        # raise ValueError("The input sequence is " + str(int(len(seq))) +
+        #                  " bp long, which is not a multiple of 3.")
 
 def get_sequence_codons(seq):
     ''' Returns the list of codons composing the input sequence `seq`. The
     codons are returned in the order in which they appear. However, methionine
     codons (included start codon) and stop codons are ignored (skipped).
     '''
-    if int(len(seq)) % 3 != 0:
-        warnings.warn("The input sequence is " + str(int(len(seq))) +
-                      " bp long, which is not a multiple of 3.")
-        # raise ValueError("The input sequence is " + str(int(len(seq))) +
-        #                  " bp long, which is not a multiple of 3.")
+    check_sequence_length(seq)
     seq = seq.lower().replace("u", "t")
-    codons_list = [seq[i:i+3] for i in range(0, (len(seq)//3)*3, 3)]
     # Ignore Methionine and STOP codons
-    codons_to_remove = {'atg', 'taa', 'tga', 'tag'}
-    return [codon for codon in codons_list if codon not in codons_to_remove]
+    return [codon for i in range(0, (len(seq)//3)*3, 3)
+            if (codon := seq[i:i+3]) not in METSTOP]
+
+def get_sequence_codons_idx(seq):
+    ''' Same as get_sequence_codons, but returns the codons as a NumPy array
+    of indices in `codons`. '''
+    check_sequence_length(seq)
+    b = np.frombuffer(seq.encode('ascii', 'replace'), dtype=np.uint8)
+    codes = BASE_CODE[b[:(len(b)//3)*3]]
+    if (codes == 255).any():
+        raise ValueError("The input sequence contains characters that are " +
+                         "not bases.")
+    codes = codes.astype(np.int32)
+    idx = (codes[0::3] << 4) | (codes[1::3] << 2) | codes[2::3]
+    # Ignore Methionine and STOP codons
+    return idx[~METSTOP_MASK[idx]]
 
 def load_s_dict(filepath):
     ''' Makes a dictionary from the input CSV file for s values.
@@ -74,8 +161,77 @@ def load_s_dict(filepath):
     return s_dict
 
 
-# Load `s` values (affinities)
-s_dict = load_s_dict("../data/" + settings['s_table_filename'])
+@functools.lru_cache(maxsize=1)
+def get_settings():
+    ''' Returns the settings dictionary (read only once). '''
+    return ut.read_json_file(os.path.join(_SRC_DIR, "settings.json"))
+
+@functools.lru_cache(maxsize=1)
+def get_s_dict():
+    ''' Returns a read-only view of the s values dictionary (loaded only
+    once, on first use). '''
+    filepath = os.path.join(_SRC_DIR, "..", "data",
+                            get_settings()['s_table_filename'])
+    return types.MappingProxyType(load_s_dict(filepath))
+
+
+BASE_IDX = types.MappingProxyType({b: i for i, b in enumerate(bases)})
+REC_IDX = types.MappingProxyType({b: i for i, b in enumerate(bases + 'il')})
+
+# Codons having a W value (all but Methionine and STOP codons). Row i of the
+# ANTICODON_IDX array holds the indices (in `codons`) of the four anticodons
+# of W_CODONS[i]
+W_CODONS = tuple(codon for codon in codons if codon not in METSTOP)
+W_CODONS_IDX = _read_only(
+    np.array([CODON_TO_IDX[c] for c in W_CODONS], dtype=np.int32))
+ANTICODON_IDX = _read_only(np.array(
+    [[CODON_TO_IDX[ac] for ac in ANTICODONS[c]] for c in W_CODONS],
+    dtype=np.int32))
+ATA_ROW = W_CODONS.index('ata')
+
+
+@functools.lru_cache(maxsize=1)
+def _get_s_tables():
+    ''' Builds the lookup tables that depend on the s values. They are
+    exposed as module attributes (see __getattr__) and built on first use, so
+    that importing this module does not read the s values file. '''
+    s_dict = get_s_dict()
+    
+    # Array version of s_dict: S_ARR[BASE_IDX[x], REC_IDX[y]] == s_dict[x + y]
+    S_ARR = _read_only(np.array(
+        [[s_dict[x + y] for y in REC_IDX] for x in BASE_IDX], dtype=np.float64))
+    
+    # Codon -> (anticodon, s) pairs, for all the codons in W_CODONS
+    CODON_WOBBLE_TABLE = types.MappingProxyType({
+        codon: tuple((ac, float(S_ARR[BASE_IDX[codon[2]],
+                                      REC_IDX[get_recognizer(codon, ac)]]))
+                     for ac in ANTICODONS[codon])
+        for codon in W_CODONS})
+    
+    # (1-s) coefficients matching ANTICODON_IDX. The ATA row is left empty
+    # because its W is the constant ATA_W (see TAI.get_W).
+    S_MATRIX = np.array(
+        [[1 - s for ac, s in CODON_WOBBLE_TABLE[c]] for c in W_CODONS],
+        dtype=np.float64)
+    S_MATRIX[ATA_ROW] = 0
+    _read_only(S_MATRIX)
+    ATA_W = (1 - S_ARR[BASE_IDX['a'],
+                       REC_IDX[get_recognizer('ata', 'cat')]]) * 1
+    
+    return {'s_dict': s_dict, 'S_ARR': S_ARR,
+            'CODON_WOBBLE_TABLE': CODON_WOBBLE_TABLE, 'S_MATRIX': S_MATRIX,
+            'ATA_W': ATA_W}
+
+def __getattr__(name):
+    ''' Lazy access to the settings and to the tables built from the s
+    values. '''
+    if name == 'settings':
+        return get_settings()
+    if name in {'s_dict', 'S_ARR', 'CODON_WOBBLE_TABLE', 'S_MATRIX', 'ATA_W'}:
+        return _get_s_tables()[name]
+    raise AttributeError("module " + repr(__name__) + " has no attribute " +
+                         repr(name))
+
 
 
 
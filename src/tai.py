@@ -10,16 +10,83 @@ It is also possible to update the object with a new set of tRNA counts.
 '''
 
 
+import math
+import numpy as np
+import types
 import biochem as bc
 import utils as ut
 
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+# Values returned by the Numba kernels when the tAI can't be computed
+_INVALID_CHARS = -1.0
+_NO_CODONS = -2.0
+
+
+def _check_tai(tai, seq_name="The input sequence"):
+    ''' Raises ValueError if `tai` is one of the error values returned by the
+    Numba kernels. '''
+    if tai == _INVALID_CHARS:
+        raise ValueError(seq_name + " contains characters that are not " +
+                         "bases.")
+    if tai == _NO_CODONS:
+        raise ValueError(seq_name + " has no codons other than Methionine " +
+                         "and STOP codons.")
+
+
+if numba is not None:
+    
+    @numba.njit(cache=True, fastmath={'reassoc', 'contract'})
+    def _tai_kernel(seq_bytes, log_w, base_code, metstop_mask):
+        ''' Returns the tAI of the CDS encoded (as ASCII bytes) by `seq_bytes`,
+        given the log of the w values (`log_w`, indexed as bc.codons).
+        Returns _INVALID_CHARS if the sequence contains characters that are
+        not bases, and _NO_CODONS if it has no codons other than Methionine
+        and STOP codons. '''
+        n = seq_bytes.shape[0]
+        total = 0.0
+        cnt = 0
+        for i in range(0, n - n % 3, 3):
+            c0 = base_code[seq_bytes[i]]
+            c1 = base_code[seq_bytes[i+1]]
+            c2 = base_code[seq_bytes[i+2]]
+            if c0 == 255 or c1 == 255 or c2 == 255:
+                return _INVALID_CHARS
+            idx = (np.int32(c0) << 4) | (np.int32(c1) << 2) | np.int32(c2)
+            # Ignore Methionine and STOP codons
+            if metstop_mask[idx]:
+                continue
+            total += log_w[idx]
+            cnt += 1
+        if cnt == 0:
+            return _NO_CODONS
+        return math.exp(total / cnt)
+    
+    @numba.njit(cache=True, parallel=True)
+    def _batch_tai(buf, offsets, log_w, base_code, metstop_mask, out):
+        ''' Writes to `out` the tAI of each of the CDSs concatenated in `buf`.
+        The s-th CDS is buf[offsets[s]:offsets[s+1]]. '''
+        for s in numba.prange(len(offsets) - 1):
+            out[s] = _tai_kernel(buf[offsets[s]:offsets[s+1]], log_w,
+                                 base_code, metstop_mask)
+
+else:
+    _tai_kernel = None
+    _batch_tai = None
+
 
 class TAI(object):
 
     def __init__(self, tRNA_counts_dict):
         
         self.tGCN_dict = None
-        self.w_dict = None
+        self.w_array = None
+        self._log_w = None
+        self._w_dict = None
         
         # Set attributes
         self.update(tRNA_counts_dict)
@@ -32,14 +99,11 @@ class TAI(object):
             raise ValueError("tRNA_counts_dict type should be dict, not " +
                              type(tRNA_counts_dict).__name__)
         
-        # Make a dictionary of tRNA gene copy numbers
-        tGCN_dict = {}
-        for k in tRNA_counts_dict.keys():
-            tGCN_dict[k.lower().replace("u","t")] = tRNA_counts_dict[k]
-        # Set to a count of 0 all the missing anticodons
-        for triplet in bc.codons:
-            if triplet not in tGCN_dict.keys():
-                tGCN_dict[triplet] = 0
+        # Make a dictionary of tRNA gene copy numbers. Missing anticodons have
+        # a count of 0
+        tGCN_dict = dict.fromkeys(bc.codons, 0)
+        for k, count in tRNA_counts_dict.items():
+            tGCN_dict[bc.normalize(k)] = count
         
         # Set attribute
         self.tGCN_dict = tGCN_dict
@@ -47,28 +111,12 @@ class TAI(object):
     def get_s(self, codon, anticodon):
         ''' Returns the s value (affinity) of the codon-anticodon pairing. '''
         
-        if anticodon not in bc.anticodons(codon):
+        if anticodon not in bc.ANTICODON_SET[codon]:
             raise ValueError(anticodon, "is not  an anticodon recognizing", codon)
         
-        # The 3rd base of the codon (`third_base`) pairs with the first base of
-        # the anticodon (`recognizer`)
-        third_base = codon[2]
-        recognizer = anticodon[0]
-        
-        # Modification of Adenine to Inosine is assumed to be the standard in
-        # Bacteria for anticodons that have an Adenine in 1st position (which
-        # pairs with the 3rd position of the codon).
-        if recognizer == 'a':
-            recognizer = 'i'
-            
-        # The ATA codon for Isoleucine can be recognized by a modified CAT
-        # anticodon, where Cytosine is modified to Lysidine (L). The L in the
-        # LAT anticodon will pair with the third base (Adenine) of the ATA
-        # codon.
-        if (codon, anticodon) == ('ata', 'cat'):
-            recognizer = 'l'
-        
-        return bc.s_dict[third_base + recognizer]
+        # The 3rd base of the codon pairs with the first base of the anticodon
+        return bc.S_ARR[bc.BASE_IDX[codon[2]],
+                        bc.REC_IDX[bc.get_recognizer(codon, anticodon)]]
     
     def get_naive_s(self, third_codon_base, first_anticodon_base):
         ''' Returns a naive s value (affinity) given the recognition of the 3rd
@@ -104,54 +152,128 @@ class TAI(object):
             return None
         
         # In bacteria, the recognition of the 'ata' (AUA) codon for Isoleucine
-        # occurs through a modified CAT anticodon (see comments in the get_s
-        # function). The abundance of that anticodon is unknown because there
-        # is no automatic way to differentiate between 'START' Met-tRNA genes
-        # and normal Met-tRNAs in any genome. Moreover, the frequency of
-        # CAT -> LAT modifications is another unknown variable. Following the
-        # original R code [https://github.com/mariodosreis/tai/blob/master/R/tAI.R
-        # lines 128, 129], we assign a token tGCN count of 1 for this pairing.
+        # occurs through a modified CAT anticodon (see comments in the
+        # bc.get_recognizer function). The abundance of that anticodon is
+        # unknown because there is no automatic way to differentiate between
+        # 'START' Met-tRNA genes and normal Met-tRNAs in any genome. Moreover,
+        # the frequency of CAT -> LAT modifications is another unknown
+        # variable. Following the original R code
+        # [https://github.com/mariodosreis/tai/blob/master/R/tAI.R lines 128,
+        # 129], we assign a token tGCN count of 1 for this pairing.
         elif codon == 'ata':
             return (1-self.get_s(codon, 'cat')) * 1
         
         else:
-            W = 0
-            for anticodon in bc.anticodons(codon):
-                W += (1-self.get_s(codon, anticodon)) * self.tGCN_dict[anticodon]
-            return W
+            return sum((1-s) * self.tGCN_dict[anticodon]
+                       for anticodon, s in bc.CODON_WOBBLE_TABLE[codon])
     
     def set_w_dict(self):
-        ''' Sets the `w_dict` attribute. First computes W_dict, then computes
-        w_dict by deviding all the W values by the largest W value. '''
+        ''' Sets the `w_array` attribute (from which `w_dict` is derived).
+        First computes the W values, then computes w by deviding all the W
+        values by the largest W value. '''
         
-        # Make codon -> W dictionary
-        W_dict = {}
-        for codon in bc.codons:
-            # Ignore Methionine and STOP codons
-            if codon not in ['atg', 'taa', 'tag', 'tga']:
-                W_dict[codon] = self.get_W(codon)
+        # tRNA gene copy numbers as an array indexed as bc.codons
+        tGCN = np.fromiter((self.tGCN_dict[c] for c in bc.codons),
+                           dtype=np.float64, count=len(bc.codons))
         
-        # Make codon -> w dictionary
-        max_W = max(W_dict.values())
-        w_dict = {}
-        for k in W_dict.keys():
-            w_dict[k] = W_dict[k] / max_W
+        # W values of all the codons except Methionine and STOP codons
+        W = (bc.S_MATRIX * tGCN[bc.ANTICODON_IDX]).sum(axis=1)
+        W[bc.ATA_ROW] += bc.ATA_W
         
-        # Substitute zeros with geometric mean of non-zeros
-        if len([w for w in w_dict.values() if w == 0]) > 0:
-            gm_non_zeros = ut.geo_mean([w for w in w_dict.values() if w != 0])
-            for k in w_dict.keys():
-                if w_dict[k] == 0:
-                    w_dict[k] = gm_non_zeros
+        # w values (in place). Zeros are substituted with the geometric mean
+        # of the non-zeros
+        w = W
+        w /= W.max()
+        zeros = w == 0
+        if zeros.any():
+            w[zeros] = ut.geo_mean_np(w[~zeros])
         
-        # Set the w_dict attribute
-        self.w_dict = w_dict
+        self._set_w_values(w)
+    
+    def _set_w_values(self, w):
+        ''' Sets the `w_array` attribute (indexed as bc.codons, NaN for
+        Methionine and STOP codons) given the w values of bc.W_CODONS. '''
+        w_array = np.full(len(bc.codons), np.nan)
+        w_array[bc.W_CODONS_IDX] = w
+        self.w_array = w_array
+        # Precomputed log(w), so that computing tAI requires no log calls
+        self._log_w = np.ascontiguousarray(np.log(w_array))
+        # w_dict will be rebuilt on access
+        self._w_dict = None
+    
+    @property
+    def w_dict(self):
+        ''' Read-only dictionary view (codon -> w) of the `w_array` attribute.
+        Methionine and STOP codons are not included. To change the w values,
+        assign a new codon -> w dictionary to this attribute. '''
+        if self._w_dict is None:
+            self._w_dict = types.MappingProxyType(dict(zip(
+                bc.W_CODONS, self.w_array[bc.W_CODONS_IDX].tolist())))
+        return self._w_dict
+    
+    @w_dict.setter
+    def w_dict(self, w_dict):
+        w_dict = {bc.normalize(k): w for k, w in w_dict.items()}
+        missing = [codon for codon in bc.W_CODONS if codon not in w_dict]
+        if len(missing) > 0:
+            raise ValueError("w_dict is missing the w values of the codons " +
+                             ", ".join(missing))
+        self._set_w_values([w_dict[codon] for codon in bc.W_CODONS])
+    
+    def _get_tai_numpy(self, seq):
+        ''' NumPy version of _tai_kernel, used when Numba is not available. '''
+        try:
+            idx = bc.get_sequence_codons_idx(seq)
+        except ValueError:
+            return _INVALID_CHARS
+        if len(idx) == 0:
+            return _NO_CODONS
+        return np.exp(self._log_w[idx].mean())
     
     def get_tai(self, seq):
         ''' Returns the tAI index of the input coding sequence. '''
-        seq_codons = [codon.lower() for codon in bc.get_sequence_codons(seq)]
-        ws = [self.w_dict[codon] for codon in seq_codons]
-        return ut.geo_mean(ws)
+        
+        # Fall back to NumPy when Numba is not available
+        if _tai_kernel is None:
+            tai = self._get_tai_numpy(seq)
+        else:
+            bc.check_sequence_length(seq)
+            seq_bytes = np.frombuffer(seq.encode('ascii', 'replace'),
+                                      dtype=np.uint8)
+            tai = _tai_kernel(seq_bytes, self._log_w, bc.BASE_CODE,
+                              bc.METSTOP_MASK)
+        _check_tai(tai)
+        return tai
+    
+    def get_tai_batch(self, seqs):
+        ''' Returns a NumPy array with the tAI index of each of the input
+        coding sequences. `seqs` can be any iterable, including generators. '''
+        seqs = list(seqs)
+        
+        # Fall back to NumPy when Numba is not available
+        if _batch_tai is None:
+            out = np.fromiter((self._get_tai_numpy(seq) for seq in seqs),
+                              dtype=np.float64, count=len(seqs))
+        
+        else:
+            # Concatenate the sequences, keeping track of their boundaries
+            for seq in seqs:
+                bc.check_sequence_length(seq)
+            encoded = [seq.encode('ascii', 'replace') for seq in seqs]
+            offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+            np.cumsum(np.fromiter(map(len, encoded), dtype=np.int64,
+                                  count=len(encoded)), out=offsets[1:])
+            buf = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+            
+            out = np.empty(len(encoded), dtype=np.float64)
+            _batch_tai(buf, offsets, self._log_w, bc.BASE_CODE,
+                       bc.METSTOP_MASK, out)
+        
+        invalid = np.flatnonzero(out < 0)
+        if len(invalid) > 0:
+            _check_tai(out[invalid[0]],
+                       "The input sequence " + str(invalid[0]))
+        return out
     
     def update(self, tRNA_counts_dict):
         ''' Update the TAI object according to a new input set of tGCN values,
@@ -175,8 +297,8 @@ class TAI(object):
                              type(tRNA_counts_dict).__name__)
         
         # Add to present tRNA genes new genes in a proportion of 1 to expr_level
-        for k in tRNA_counts_dict.keys():
-            self.tGCN_dict[k.lower().replace("u","t")] += tRNA_counts_dict[k] * expr_level
+        for k, count in tRNA_counts_dict.items():
+            self.tGCN_dict[bc.normalize(k)] += count * expr_level
         
         
     
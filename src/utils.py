@@ -7,8 +7,9 @@ biochem.py.
 '''
 
 
-from functools import reduce
 import json
+import math
+import numpy as np
 
 
 def read_json_file(filename):
@@ -17,10 +18,15 @@ def read_json_file(filename):
     return obj
 
 def product(xs):
-    return reduce(lambda x,y: x*y,xs)
+    return math.prod(xs)
 
 def geo_mean(xs):
-    return (product(xs)) ** (1/len(xs))
+    # Computed in log space to avoid the underflow of the product of many
+    # values smaller than 1
+    return math.exp(math.fsum(math.log(x) for x in xs) / len(xs))
+
+def geo_mean_np(arr):
+    return np.exp(np.log(arr).mean())
 
 
 
@@ -0,0 +1,146 @@
+'''
+
+Checks that the Numba and NumPy implementations of tAI agree with each
+other and with the reference computation based on get_sequence_codons and
+w_dict.
+
+'''
+
+
+import math
+import os
+import random
+import sys
+import warnings
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "src"))
+
+import biochem as bc
+import tai
+
+
+random.seed(0)
+TRNA_COUNTS = {c.upper(): random.randint(0, 4) for c in bc.codons
+               if random.random() < 0.6}
+SEQS = ["".join(random.choice("acgt") for _ in range(random.randint(3, 900)))
+        for _ in range(20)]
+SEQS += [seq.upper() for seq in SEQS[:5]]
+SEQS += [seq.upper().replace("T", "U") for seq in SEQS[5:10]]
+SEQS += ["aaatttgggcc", "AUGAAACCCUAAg"]  # Lengths not multiple of 3
+
+INVALID_SEQS = ["aaanttggg", "aaa-tt", "aaaccç"]
+EMPTY_SEQS = ["", "at", "atgtaatag"]
+
+
+def reference_tai(calculator, seq):
+    ws = [calculator.w_dict[codon] for codon in bc.get_sequence_codons(seq)]
+    return math.exp(math.fsum(math.log(w) for w in ws) / len(ws))
+
+
+@pytest.fixture(params=["numba", "numpy"])
+def calculator(request, monkeypatch):
+    if request.param == "numba" and tai.numba is None:
+        pytest.skip("numba is not installed")
+    if request.param == "numpy":
+        monkeypatch.setattr(tai, "_tai_kernel", None)
+        monkeypatch.setattr(tai, "_batch_tai", None)
+    return tai.TAI(TRNA_COUNTS)
+
+
+@pytest.fixture(autouse=True)
+def ignore_length_warnings():
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        yield
+
+
+def test_get_tai(calculator):
+    for seq in SEQS:
+        assert math.isclose(calculator.get_tai(seq),
+                            reference_tai(calculator, seq), rel_tol=1e-9)
+
+
+def test_get_tai_batch(calculator):
+    expected = [reference_tai(calculator, seq) for seq in SEQS]
+    result = calculator.get_tai_batch(SEQS)
+    assert len(result) == len(SEQS)
+    for x, y in zip(result, expected):
+        assert math.isclose(x, y, rel_tol=1e-9)
+
+
+def test_get_tai_batch_generator(calculator):
+    result = calculator.get_tai_batch(seq for seq in SEQS)
+    assert len(result) == len(SEQS)
+    for seq, x in zip(SEQS, result):
+        assert math.isclose(x, reference_tai(calculator, seq), rel_tol=1e-9)
+
+
+def test_length_warning(calculator):
+    with pytest.warns(UserWarning, match="not a multiple of 3"):
+        calculator.get_tai("aaatttg")
+
+
+def test_invalid_characters(calculator):
+    for seq in INVALID_SEQS:
+        with pytest.raises(ValueError, match="not bases"):
+            calculator.get_tai(seq)
+    with pytest.raises(ValueError, match="sequence 1 contains"):
+        calculator.get_tai_batch(["aaa"] + INVALID_SEQS)
+
+
+def test_no_codons(calculator):
+    for seq in EMPTY_SEQS:
+        with pytest.raises(ValueError, match="no codons"):
+            calculator.get_tai(seq)
+    with pytest.raises(ValueError, match="sequence 1 has no codons"):
+        calculator.get_tai_batch(["aaa"] + EMPTY_SEQS)
+
+
+def expected_w_dict(calculator):
+    ''' w values computed with the scalar get_W. '''
+    W = {codon: calculator.get_W(codon) for codon in bc.W_CODONS}
+    max_W = max(W.values())
+    w = {codon: W[codon] / max_W for codon in bc.W_CODONS}
+    non_zeros = [x for x in w.values() if x != 0]
+    gm = math.exp(math.fsum(math.log(x) for x in non_zeros) / len(non_zeros))
+    return {codon: (gm if x == 0 else x) for codon, x in w.items()}
+
+
+@pytest.mark.parametrize("counts", [TRNA_COUNTS, {"AAA": 2, "gcu": 1}])
+def test_w_dict_matches_get_W(counts):
+    calculator = tai.TAI(counts)
+    expected = expected_w_dict(calculator)
+    if counts is not TRNA_COUNTS:
+        # Some W are 0, hence the substitution with the geometric mean
+        assert any(calculator.get_W(codon) == 0 for codon in bc.W_CODONS)
+    assert set(calculator.w_dict) == set(bc.W_CODONS)
+    for codon in bc.W_CODONS:
+        assert math.isclose(calculator.w_dict[codon], expected[codon],
+                            rel_tol=1e-12)
+
+
+def test_w_dict_assignment(calculator):
+    seqs = ["aaatttggg", "cccaaa"]
+    new_w = {codon.upper().replace("T", "U"): 0.5 for codon in bc.W_CODONS}
+    new_w["UUU"] = 1.0
+    calculator.w_dict = new_w
+    assert calculator.w_dict["ttt"] == 1.0
+    assert math.isclose(calculator.get_tai(seqs[0]), 0.5 ** (2/3),
+                        rel_tol=1e-12)
+    result = calculator.get_tai_batch(seqs)
+    assert math.isclose(result[0], 0.5 ** (2/3), rel_tol=1e-12)
+    assert math.isclose(result[1], 0.5, rel_tol=1e-12)
+
+
+def test_w_dict_assignment_missing_codons(calculator):
+    new_w = {codon: 0.5 for codon in bc.W_CODONS if codon != "ttt"}
+    with pytest.raises(ValueError, match="ttt"):
+        calculator.w_dict = new_w
+
+
+def test_w_dict_read_only(calculator):
+    with pytest.raises(TypeError):
+        calculator.w_dict["ttt"] = 0.5